@@ -0,0 +1,290 @@
+#!python3
+
+"""Static cycle analysis of assembled programs.
+
+Builds the control flow graph of the ROM from the resolved jump targets and
+computes best and worst case cycle counts for every routine (non dot label)
+and every label inside it, counted from the label until control leaves the
+routine or the program halts (a jump to itself).
+"""
+
+import sys
+import heapq
+
+from compile import assemble, single_bank
+from isa import ADDR_SPACE, NOP, build_rom, compare
+
+# cycles taken by each instruction type
+DEFAULT_CYCLES = {'NOP': 1, 'JMP': 1, 'MOV': 1, 'ACC': 1, 'ATC': 1}
+
+
+#####
+# Results
+##
+
+class Bounds:
+
+    def __init__(self, name, entry, best, worst, worst_path):
+        self.name = name
+        self.entry = entry
+        self.best = best
+        self.worst = worst
+        self.worst_path = worst_path
+
+    def __repr__(self):
+        return 'Bounds(%s @%d: %s..%s)' % (
+                self.name, self.entry, self.best,
+                'unbounded' if self.worst is None else self.worst)
+
+    def is_bounded(self):
+        return not self.worst is None
+
+class LoopFound(Exception):
+    pass
+
+
+#####
+# Analysis
+##
+
+class Analysis:
+
+    def __init__(self, rom, labels, dot_labels, ip_inc=1, cycles=None):
+        self.rom = rom
+        self.labels = labels
+        self.dot_labels = dot_labels
+        self.ip_inc = ip_inc
+        self.cycles = dict(DEFAULT_CYCLES, **(cycles or {}))
+
+        entries = [0] + sorted(labels.values()) + sorted(rom)
+        self.graph = self.build_graph(entries)
+        self.halts = sorted(addr for addr, succs in self.graph.items()
+                if succs == [addr])
+        self.loops = self.find_loops()
+
+        self.routines = self.find_routines()
+        self.results = []
+        if 0 in rom:
+            self.results.append(self.bounds('<reset>', 0, None))
+        for name, start, region in self.routines:
+            self.results.append(self.bounds(name, start, region))
+            for dot_label, addr in dot_labels:
+                if addr in region:
+                    self.results.append(
+                            self.bounds(name + '.' + dot_label, addr, region))
+
+    def instruction(self, addr):
+        # unused ROM words read as 35'b0, which is a NOP
+        return self.rom.get(addr, (NOP, None))[0]
+
+    def cost(self, addr):
+        return self.cycles.get(self.instruction(addr).name, 1)
+
+    def successors(self, addr):
+        inst = self.instruction(addr)
+        following = (addr + self.ip_inc) % ADDR_SPACE
+        if inst.name == 'JMP':
+            if inst.type1 == 0 and inst.type2 == 0:
+                # both operands are numbers so the outcome is known
+                if compare(inst.func, inst.op1, inst.op2):
+                    return [inst.dest]
+                return [following]
+            return sorted({following, inst.dest})
+        if inst.name == 'ATC':
+            return sorted({following, inst.dest})
+        return [following]
+
+    def build_graph(self, entries):
+        graph = {}
+        pending = list(entries)
+        while pending:
+            addr = pending.pop()
+            if addr in graph:
+                continue
+            graph[addr] = self.successors(addr)
+            pending.extend(graph[addr])
+        return graph
+
+    def edges(self, addr):
+        # halting self jumps don't count as loops
+        succs = self.graph[addr]
+        return [] if succs == [addr] else succs
+
+    def find_loops(self):
+        # tarjan's strongly connected components
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        loops = []
+
+        def connect(addr):
+            index[addr] = lowlink[addr] = len(index)
+            stack.append(addr)
+            on_stack.add(addr)
+            for succ in self.edges(addr):
+                if not succ in index:
+                    connect(succ)
+                    lowlink[addr] = min(lowlink[addr], lowlink[succ])
+                elif succ in on_stack:
+                    lowlink[addr] = min(lowlink[addr], index[succ])
+            if lowlink[addr] == index[addr]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == addr:
+                        break
+                if len(component) > 1 or addr in self.edges(addr):
+                    loops.append(sorted(component))
+
+        for addr in sorted(self.graph):
+            if not addr in index:
+                connect(addr)
+        return sorted(loops)
+
+    def find_routines(self):
+        sequential = sorted(addr for addr, (_, line) in self.rom.items()
+                if line.hard_addr is None)
+        starts = sorted(set(self.labels.values()))
+        routines = []
+        for name, start in sorted(self.labels.items(), key=lambda l: l[1]):
+            later = [addr for addr in starts if addr > start]
+            end = later[0] if later else ADDR_SPACE
+            region = set(addr for addr in sequential if start <= addr < end)
+            routines.append((name, start, region))
+        return routines
+
+    def bounds(self, name, entry, region):
+        def inside(addr):
+            return region is None or addr in region
+
+        if not inside(entry):
+            return Bounds(name, entry, 0, 0, [])
+
+        def terminates(addr):
+            succs = self.graph[addr]
+            return succs == [addr] or not all(map(inside, succs))
+
+        # best case, shortest path to an exit (dijkstra)
+        best = None
+        dist = {entry: self.cost(entry)}
+        queue = [(dist[entry], entry)]
+        while queue:
+            cycles, addr = heapq.heappop(queue)
+            if cycles > dist[addr]:
+                continue
+            if terminates(addr):
+                best = cycles
+                break
+            for succ in self.edges(addr):
+                if cycles + self.cost(succ) < dist.get(succ, cycles + 1e9):
+                    dist[succ] = cycles + self.cost(succ)
+                    heapq.heappush(queue, (dist[succ], succ))
+
+        # worst case, longest path to an exit which only exists without loops
+        longest = {}
+        visiting = set()
+
+        def visit(addr):
+            if addr in longest:
+                return longest[addr]
+            if addr in visiting:
+                raise LoopFound()
+            visiting.add(addr)
+            tail = (0, [])
+            for succ in filter(inside, self.edges(addr)):
+                candidate = visit(succ)
+                if candidate[0] > tail[0]:
+                    tail = candidate
+            visiting.discard(addr)
+            longest[addr] = (self.cost(addr) + tail[0], [addr] + tail[1])
+            return longest[addr]
+
+        try:
+            worst, path = visit(entry)
+        except LoopFound:
+            worst, path = None, None
+        return Bounds(name, entry, best, worst, path)
+
+    def name_of(self, addr):
+        for name, start, region in self.routines:
+            if addr in region:
+                for dot_label, dot_addr in self.dot_labels:
+                    if dot_addr == addr:
+                        return name + '.' + dot_label
+                return name if addr == start else None
+        return None
+
+    def over_budget(self, budgets):
+        """Return the results whose worst case exceeds their cycle budget."""
+        return [result for result in self.results if result.name in budgets
+                and (result.worst is None or result.worst > budgets[result.name])]
+
+    def report(self):
+        def describe(addrs):
+            names = [name for name in map(self.name_of, addrs) if name]
+            text = ', '.join(map(str, addrs))
+            if names:
+                text += ' (%s)' % ', '.join(names)
+            return text
+
+        width = max([len(r.name) for r in self.results] + [len('label')])
+        template = '%-' + str(width) + 's  %5s  %5s  %9s'
+        output = [template % ('label', 'addr', 'best', 'worst')]
+        for result in self.results:
+            output.append(template % (
+                    result.name, result.entry,
+                    '-' if result.best is None else result.best,
+                    'unbounded' if result.worst is None else result.worst))
+
+        output.append('')
+        output.append('unbounded loops:')
+        for loop in self.loops:
+            output.append('\t' + describe(loop))
+        if not self.loops:
+            output.append('\tnone')
+
+        output.append('')
+        output.append('halts:')
+        for addr in self.halts:
+            output.append('\t' + describe([addr]))
+        if not self.halts:
+            output.append('\tnone')
+        return '\n'.join(output)
+
+
+#####
+# Analysis entry point
+##
+
+def analyze(assembly, cycles=None, **settings):
+    lines, settings = assemble(assembly, **settings)
+    return Analysis(build_rom(single_bank(lines)), settings['labels'],
+            settings['dot_labels'], settings.get('ip_inc', 1), cycles)
+
+
+#####
+# Main entry point
+##
+def main():
+    prog, *args = sys.argv
+
+    if len(args) < 1:
+        print('usage: %s PATH [IP_INC]' % prog)
+        return
+
+    ip_inc = 1
+    if len(args) > 1:
+        try:
+            ip_inc = int(args[1])
+        except ValueError:
+            pass
+
+    with open(args[0]) as fp:
+        print(analyze(fp.read(), ip_inc=ip_inc).report())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""Vectorised encoding of whole ROM images with NumPy.
+
+Instead of going through the text pipeline one program at a time, the
+instruction fields of many instructions (or many ROMs) are given as columns
+and packed into 35 bit words in bulk. Columns broadcast against each other,
+so a shape (roms, words) operand column combined with scalar opcode and
+function fields encodes a family of variants of the same program.
+"""
+
+import numpy as np
+
+from compile import Line, format_rom
+from isa import ADDR_SPACE, FIELDS, MACROS, WIDTHS, WORD_BITS
+
+DTYPE = np.dtype([(field, np.uint8) for field in FIELDS])
+
+SHIFTS = dict(zip(FIELDS,
+    [sum(WIDTHS[i + 1:]) for i in range(len(WIDTHS))]))
+
+# fields which may be given as negative (two's complement) numbers
+SIGNED_FIELDS = ('op1', 'op2', 'dest')
+
+
+#####
+# Exceptions
+##
+
+class FieldWidthException(Exception):
+    def __init__(self, field, width, index, value):
+        super().__init__('%s: %d doesn\'t fit in %d bits, at %s' % (
+            field, value, width, index))
+
+class FieldTypeException(Exception):
+    def __init__(self, field, dtype):
+        super().__init__('%s: %s values aren\'t integers' % (field, dtype))
+
+class UnknownMacroException(Exception):
+    def __init__(self, field, name):
+        super().__init__('%s: \'%s\' is not a macro or a number' % (
+            field, name))
+
+
+#####
+# Encoding
+##
+
+def macro_values(column, field):
+    """Replace macro names (e.g. 'JMP', '`DOUT') in a column by values."""
+    column = np.asarray(column)
+    if column.dtype.kind in 'iub':
+        return column
+    if column.dtype.kind not in 'US':
+        raise FieldTypeException(field, column.dtype)
+
+    def value(name):
+        name = str(name).strip().lstrip('`')
+        if name in MACROS:
+            return MACROS[name][1]
+        try:
+            return int(name, 0)
+        except ValueError:
+            raise UnknownMacroException(field, name)
+
+    return np.vectorize(value, otypes=[np.int64])(column)
+
+def columns_of(fields):
+    if isinstance(fields, np.ndarray) and fields.dtype.names:
+        return {field: fields[field] for field in fields.dtype.names}
+    return dict(fields)
+
+def encode(fields):
+    """Pack instruction fields into 35 bit words.
+
+    fields is a structured array with the FIELDS of an instruction or a
+    {field: column} dict, where a column is an array, a number or a macro
+    name. Missing fields are 0. Operands and destinations (SIGNED_FIELDS)
+    may be negative, in which case their two's complement is used like a
+    negative Verilog number would.
+    Columns have to hold integers (or booleans), anything else raises
+    FieldTypeException. Returns a uint64 array of the broadcast shape of the
+    columns.
+    """
+    columns = columns_of(fields)
+    unknown = set(columns) - set(FIELDS)
+    if unknown:
+        raise KeyError(', '.join(sorted(unknown)))
+
+    values = [macro_values(columns.get(field, 0), field).astype(np.int64)
+            for field in FIELDS]
+    values = np.broadcast_arrays(*values)
+
+    words = np.zeros(values[0].shape, dtype=np.uint64)
+    for field, width, value in zip(FIELDS, WIDTHS, values):
+        lowest = -(1 << (width - 1)) if field in SIGNED_FIELDS else 0
+        bad = (value < lowest) | (value >= (1 << width))
+        if bad.any():
+            index = tuple(int(i) for i in np.argwhere(bad)[0])
+            raise FieldWidthException(field, width, index, value[index])
+        masked = (value & ((1 << width) - 1)).astype(np.uint64)
+        words |= masked << np.uint64(SHIFTS[field])
+    return words
+
+def decode(words):
+    """Unpack 35 bit words into a structured array of instruction fields."""
+    words = np.asarray(words, dtype=np.uint64)
+    fields = np.zeros(words.shape, dtype=DTYPE)
+    for field, width in zip(FIELDS, WIDTHS):
+        fields[field] = (words >> np.uint64(SHIFTS[field])) & \
+                np.uint64((1 << width) - 1)
+    return fields
+
+
+#####
+# Output
+##
+
+def binary_literals(words):
+    """Format words as 35'b literals with an underscore between fields."""
+    words = np.asarray(words, dtype=np.uint64).reshape(-1)
+    shifts = np.arange(WORD_BITS - 1, -1, -1, dtype=np.uint64)
+    bits = ((words[:, None] >> shifts) & np.uint64(1)).astype(np.uint8)
+    digits = bits + ord('0')
+
+    # splice the underscores in between the field columns
+    separated = []
+    start = 0
+    for width in WIDTHS:
+        if start:
+            separated.append(np.full((len(words), 1), ord('_'), np.uint8))
+        separated.append(digits[:, start:start + width])
+        start += width
+    chars = np.concatenate(separated, axis=1)
+    return ['35\'b' + row.decode('ascii')
+            for row in map(bytes, chars)]
+
+def case_block(literals, ip_inc):
+    lines = [Line(addr, '\t\t%d: data = %s;' % (addr * ip_inc, literal))
+            for addr, literal in enumerate(literals)]
+    return format_rom(lines)
+
+def to_verilog(words, ip_inc=1):
+    """Format the words of one ROM as the case block compile() produces.
+
+    A single word makes a ROM of one word, a 2D array holds one ROM per row
+    and a list of texts is returned for it.
+    """
+    words = np.atleast_1d(np.asarray(words, dtype=np.uint64))
+    if (words.shape[-1] - 1) * ip_inc >= ADDR_SPACE:
+        raise ValueError('%d words don\'t fit in the ROM' % words.shape[-1])
+
+    # format every word of every ROM in one go
+    literals = binary_literals(words)
+    if words.ndim == 1:
+        return case_block(literals, ip_inc)
+    size = words.shape[-1]
+    return [case_block(literals[start:start + size], ip_inc)
+            for start in range(0, len(literals), size)]
+
+def write_roms(words, pattern, ip_inc=1):
+    """Write every ROM (row) of words to pattern % index, returns the paths."""
+    words = np.atleast_2d(np.asarray(words, dtype=np.uint64))
+    words = words.reshape(-1, words.shape[-1])
+    paths = []
+    for index, text in enumerate(to_verilog(words, ip_inc)):
+        path = pattern % index
+        with open(path, 'w') as fp:
+            fp.write(text)
+        paths.append(path)
+    return paths
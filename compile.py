@@ -1,7 +1,14 @@
 #!python3
 
+import os
 import sys
 import re
+import mmap
+import stat
+import json
+import hashlib
+
+from isa import parse_addresses
 
 DEBUG = 0
 
@@ -10,6 +17,8 @@ DEBUG = 0
 ##
 
 class Line:
+    __slots__ = ('linenum', 'addr', 'text', 'comment', 'hard_addr', 'code',
+            'bank', 'padding')
 
     def __init__(self, linenum, text):
         self.linenum = linenum
@@ -17,6 +26,9 @@ class Line:
         self.text = text
         self.comment = None
         self.hard_addr = None
+        self.code = None
+        self.bank = 0
+        self.padding = False
 
     def __str__(self):
         val = []
@@ -57,6 +69,26 @@ class DuplicateDefineException(Exception):
     def __init__(self, label, line):
         super().__init__('\'@%s\', line: %d' % (label, line.linenum))
 
+class AddressOverflowException(Exception):
+    def __init__(self, line, bank_size):
+        super().__init__('addr: %d, bank: %d, line: %d, bank size: %d' % (
+            line.addr, line.bank, line.linenum, bank_size))
+
+class BankDirectiveException(Exception):
+    def __init__(self, text, line):
+        super().__init__('\'%s\', line: %d, expected .bank NUMBER' % (
+            text, line.linenum))
+
+class FarReferenceException(Exception):
+    def __init__(self, label, line):
+        super().__init__('\'@%s\', line: %d, only jumps can reach another bank'
+                % (label, line.linenum))
+
+class MultipleBanksException(Exception):
+    def __init__(self, banks):
+        super().__init__('banks: %s, only compile_banks() handles banks' %
+                ', '.join(map(str, banks)))
+
 #####
 # Helpers
 ##
@@ -65,11 +97,12 @@ processors = []
 
 def fix_line_addresses(lines, settings):
     ip_inc = settings.get('ip_inc', 1)
-    count = 0
+    # every bank has its own address space
+    counts = {}
     for line in lines:
         if line.has_addr():
-            line.addr = count
-            count += ip_inc
+            line.addr = counts.get(line.bank, 0)
+            counts[line.bank] = line.addr + ip_inc
     return lines
 
 def processor(func):
@@ -212,29 +245,415 @@ def hardcoded_addresses(lines, _):
                 updated_lines.append(line)
     return lines
 
+def is_label_definition(text):
+    return text.endswith(':') and not text.startswith(('.', '['))
+
+def label_name(text):
+    return text.split(':')[0].strip().split(' ')[0].strip()
+
+def is_unconditional_jump(text):
+    return text.startswith(('jmp(', '{`JMP, `UNC', '{`JMP,`UNC'))
+
+def split_chains(lines):
+    """Split lines into chains of routines which fall through into each
+    other, and so have to stay together."""
+    chains = [[]]
+    falls_through = False
+    for line in lines:
+        text = line.text.strip()
+        if is_label_definition(text):
+            if not falls_through and chains[-1]:
+                chains.append([])
+            # a label without code falls through into whatever follows
+            falls_through = True
+        chains[-1].append(line)
+        if line.has_addr() and not text.endswith(':'):
+            falls_through = not is_unconditional_jump(text)
+    return chains
+
+def chain_words(chain):
+    return len([line for line in chain
+            if line.has_addr() and not line.text.strip().endswith(':')])
+
+def place_routines(lines, settings):
+    """Spread the routines of a program over banks.
+
+    Routines that fall through into each other always share a bank. After
+    that routines are greedily grouped along their heaviest references, a
+    reference weighing as much as the cycles the referring routine took in
+    the 'profile' setting (label -> cycles), so that hot code ends up in
+    the same bank as its jump targets.
+    """
+    ip_inc = settings.get('ip_inc', 1)
+    capacity = -(-settings.get('bank_size', 256) // ip_inc)
+    profile = settings.get('profile', {})
+
+    chains = split_chains(lines)
+
+    owner = {}
+    for index, chain in enumerate(chains):
+        for line in chain:
+            if is_label_definition(line.text.strip()):
+                owner[label_name(line.text.strip())] = index
+
+    def hotness(chain):
+        return 1 + sum(profile.get(label.replace('`', ''), 0)
+                for label, index in owner.items() if chains[index] is chain)
+
+    weights = {}
+    targets = [set() for _ in chains]
+    for index, chain in enumerate(chains):
+        for line in chain:
+            for label in re.findall(r'@([\w`]+)', line.text):
+                other = owner.get(label)
+                if other is None or other == index:
+                    continue
+                targets[index].add(label)
+                key = (min(index, other), max(index, other))
+                weights[key] = weights.get(key, 0) + hotness(chain)
+
+    # group chains along the heaviest references while they fit in a bank,
+    # leaving room for the far jump stubs (two words per outside target and
+    # one per target reached from outside, see far_stubs())
+    groups = [[index] for index in range(len(chains))]
+    group_of = list(range(len(chains)))
+
+    def size(group):
+        outside = set()
+        inside = set()
+        for index in range(len(chains)):
+            for label in targets[index]:
+                if index in group and not owner[label] in group:
+                    outside.add(label)
+                elif not index in group and owner[label] in group:
+                    inside.add((index, label))
+        return sum(chain_words(chains[index]) for index in group) + \
+                2 * len(outside) + len(inside)
+
+    for (a, b), _ in sorted(weights.items(), key=lambda w: (-w[1], w[0])):
+        ga, gb = group_of[a], group_of[b]
+        if ga == gb or size(groups[ga] + groups[gb]) > capacity:
+            continue
+        groups[ga] += groups[gb]
+        for index in groups[gb]:
+            group_of[index] = ga
+        groups[gb] = []
+
+    # pack groups into banks, the group holding the reset vector goes first
+    groups = [group for group in groups if group]
+    first = [group for group in groups if 0 in group]
+    rest = sorted([group for group in groups if not 0 in group],
+            key=lambda group: -size(group))
+    free = []
+    for group in first + rest:
+        for bank, space in enumerate(free):
+            if size(group) <= space:
+                break
+        else:
+            bank = len(free)
+            free.append(capacity)
+        free[bank] -= size(group)
+        for index in group:
+            for line in chains[index]:
+                line.bank = bank
+
+    return sorted(lines, key=lambda line: line.bank)
+
+@processor
+def banks(lines, settings):
+    # find bank directives
+    updated_lines = []
+    bank = 0
+    for line in lines:
+        text = line.text.strip()
+        if text.startswith('.bank ') or text == '.bank':
+            args = text.split()[1:]
+            if len(args) != 1 or not args[0].isdigit():
+                raise BankDirectiveException(text, line)
+            bank = int(args[0])
+        else:
+            line.bank = bank
+            updated_lines.append(line)
+
+    if settings.get('banking') == 'auto':
+        updated_lines = place_routines(updated_lines, settings)
+
+    # jumps to labels in another bank go through a stub, see far_stubs()
+    label_banks = {}
+    for line in updated_lines:
+        text = line.text.strip()
+        if is_label_definition(text):
+            label_banks[label_name(text)] = line.bank
+
+    stubs = {}
+    for line in updated_lines:
+        target = jump_target(line.text)
+
+        def far(match):
+            label = match.group(1)
+            if label_banks.get(label, line.bank) == line.bank:
+                return match.group(0)
+            if target != match.span():
+                raise FarReferenceException(label, line)
+            return '@' + stubs.setdefault((line.bank, label), '__far%d_%s' %
+                    (line.bank, label))
+
+        line.text = re.sub(r'@([\w`]+)', far, line.text)
+
+    return far_stubs(updated_lines, stubs, label_banks, settings)
+
+def jump_target(text):
+    """Return the span of the destination of a jump in text, or None."""
+    body = text.rstrip()
+    if body.lstrip().startswith(('jmp(', 'atc(')) and body.endswith(')'):
+        start = max(body.find('('), body.rfind(','))
+    elif body.lstrip().startswith(('{`JMP', '{`ATC')) and body.endswith('}'):
+        start = body.rfind(',')
+    else:
+        return None
+    end = len(body) - 1
+    dest = body[start + 1:end]
+    start += 1 + len(dest) - len(dest.lstrip())
+    end -= len(dest) - len(dest.rstrip())
+    return (start, end)
+
+def far_stubs(lines, stubs, label_banks, settings):
+    """Add the stubs through which jumps reach labels in other banks.
+
+    A stub writes the bank of the label to the `BANK register and then
+    jumps to it. Whether the CPU switches banks right after the write or
+    only when the next jump is taken, the word following the write has to
+    be that jump in both banks, so every stub gets its own pair of
+    addresses, counting down from the top of the bank, which are free in
+    the bank of the jump and the bank of the label alike. The sequential
+    code of a bank has to stay below its lowest stub address, which ends
+    up in settings['bank_limits'].
+    """
+    ip_inc = settings.get('ip_inc', 1)
+    bank_size = settings.get('bank_size', 256)
+    top = (min(bank_size, 256) - 1) // ip_inc * ip_inc
+
+    used = {}
+    ends = {}
+    for line in lines:
+        if not line.hard_addr is None:
+            used.setdefault(line.bank, set()).update(
+                    parse_addresses(line.hard_addr))
+        elif line.has_addr() and not line.text.strip().endswith(':'):
+            ends[line.bank] = ends.get(line.bank, 0) + ip_inc
+
+    def free(bank, addr):
+        return addr >= ends.get(bank, 0) and \
+                not addr in used.setdefault(bank, set())
+
+    limits = {}
+    addrs = {}
+    for (bank, label), stub in sorted(stubs.items()):
+        other = label_banks[label]
+        addr = top - ip_inc
+        while addr >= 0 and not (free(bank, addr) and
+                free(bank, addr + ip_inc) and free(other, addr + ip_inc)):
+            addr -= ip_inc
+        source = [line for line in lines if stub in line.text][0]
+        if addr < 0:
+            raise AddressOverflowException(source, bank_size)
+        used[bank] |= {addr, addr + ip_inc}
+        used[other].add(addr + ip_inc)
+        limits[bank] = min(limits.get(bank, addr), addr)
+        limits[other] = min(limits.get(other, addr + ip_inc), addr + ip_inc)
+        addrs[stub] = (source, addr)
+
+    for line in lines:
+        for stub, (_, addr) in addrs.items():
+            line.text = line.text.replace('@' + stub, str(addr))
+
+    stub_lines = []
+    for (bank, label), stub in sorted(stubs.items()):
+        source, addr = addrs[stub]
+        jump = '{`JMP, `UNC, `N10, `N10, @%s}' % label
+        for word_bank, word_addr, text in [
+                (bank, addr, '{`MOV, `PUR, `NUM, %d, `REG, `BANK, `N8}' %
+                    label_banks[label]),
+                (bank, addr + ip_inc, jump),
+                (label_banks[label], addr + ip_inc, jump)]:
+            stub_line = Line(source.linenum, text)
+            stub_line.addr = None
+            stub_line.hard_addr = str(word_addr)
+            stub_line.bank = word_bank
+            stub_lines.append(stub_line)
+
+    # the stubs go at the end of their bank, in address order
+    for stub_line in sorted(stub_lines, key=lambda line: int(line.hard_addr)):
+        last = max(i for i, line in enumerate(lines)
+                if line.bank == stub_line.bank)
+        lines.insert(last + 1, stub_line)
+
+    settings['bank_limits'] = limits
+    return lines
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+@processor
+def pinned_addresses(lines, settings):
+    """Keep routines at the addresses given in the 'pins' setting.
+
+    Pins map a label to an address, or to [address, hash] in which case the
+    routine is only pinned while its source still has that hash (see
+    manifest()). Pinned chains of routines (see split_chains()) go to their
+    addresses, the others fill the gaps in between or go after them, and
+    unused words are left empty. The first chain stays at the reset
+    address. Pins are dropped for a bank that would overflow with them.
+    The address and source hash of every routine end up in
+    settings['routines'].
+    """
+    ip_inc = settings.get('ip_inc', 1)
+    pins = settings.get('pins')
+
+    # hash the source of every routine, up to the next (non dot) label
+    routines = {}
+    current = None
+    for line in lines:
+        text = line.text.strip()
+        if is_label_definition(text):
+            current = label_name(text).replace('`', '')
+            routines[current] = []
+        elif current and text:
+            routines[current].append(text)
+    hashes = {label: content_hash('\n'.join(texts))
+            for label, texts in routines.items()}
+
+    def pinned(label):
+        pin = pins.get(label)
+        if isinstance(pin, (list, tuple)):
+            pin = pin[0] if pin[1] == hashes[label] else None
+        if not pin is None and pin % ip_inc == 0:
+            return pin
+
+    def limit(bank):
+        bank_size = settings.get('bank_size', 256)
+        return min(bank_size,
+                settings.get('bank_limits', {}).get(bank, bank_size))
+
+    if pins:
+        banks = []
+        for line in lines:
+            if not line.bank in banks:
+                banks.append(line.bank)
+
+        updated_lines = []
+        for bank in banks:
+            chains = split_chains([line for line in lines if line.bank == bank])
+
+            # chains without code stick to the one before them
+            merged = []
+            for chain in chains:
+                if merged and (not chain_words(chain) or
+                        not chain_words(merged[-1])):
+                    merged[-1] += chain
+                else:
+                    merged.append(chain)
+
+            # (start, end) of every placed chain
+            placed = {}
+            # (start, end) of the slot of every word with a hardcoded address
+            hardcoded = [
+                    (addr // ip_inc * ip_inc, (addr // ip_inc + 1) * ip_inc)
+                    for line in lines
+                    if line.bank == bank and not line.hard_addr is None
+                    for addr in parse_addresses(line.hard_addr)]
+
+            def fits(start, size):
+                return all(start + size <= begin or start >= end
+                        for begin, end in list(placed.values()) + hardcoded)
+
+            def place(index, start):
+                size = chain_words(merged[index]) * ip_inc
+                placed[index] = (start, start + size)
+
+            place(0, 0)
+            requests = []
+            for index, chain in enumerate(merged[1:], 1):
+                labels = [label_name(line.text.strip()).replace('`', '')
+                        for line in chain
+                        if is_label_definition(line.text.strip())]
+                addrs = [pinned(label) for label in labels]
+                # only pin a chain if all of its routines still fit together
+                if addrs and not None in addrs:
+                    requests.append((addrs[0], index))
+            for start, index in sorted(requests):
+                if fits(start, chain_words(merged[index]) * ip_inc):
+                    place(index, start)
+            for index, chain in enumerate(merged):
+                if index in placed:
+                    continue
+                size = chain_words(chain) * ip_inc
+                starts = sorted([0] + [end for _, end in
+                        list(placed.values()) + hardcoded])
+                place(index,
+                        [start for start in starts if fits(start, size)][0])
+
+            # without the gaps between pinned chains the bank might still fit,
+            # rather drop its pins than fail
+            if max(end for _, end in placed.values()) > limit(bank):
+                updated_lines += [line for line in lines if line.bank == bank]
+                continue
+
+            # lay out the chains, leaving unused words empty
+            count = 0
+            for index in sorted(placed, key=lambda index: placed[index]):
+                start, end = placed[index]
+                for _ in range((start - count) // ip_inc):
+                    padding = Line(merged[index][0].linenum, '')
+                    padding.bank = bank
+                    padding.padding = True
+                    updated_lines.append(padding)
+                updated_lines += merged[index]
+                count = max(count, end)
+        lines = updated_lines
+
+    # addresses the routines will have once the labels are gone
+    counts = {}
+    addresses = {}
+    for line in lines:
+        text = line.text.strip()
+        if is_label_definition(text):
+            addresses[label_name(text).replace('`', '')] = \
+                    counts.get(line.bank, 0)
+        elif line.has_addr() and not text.endswith(':'):
+            counts[line.bank] = counts.get(line.bank, 0) + ip_inc
+
+    settings['routines'] = {label: [addresses[label], hashes[label]]
+            for label in hashes}
+    return lines
+
 @processor
 def labels(lines, settings):
     labels = {}
     dot_labels = {}
+    all_dot_labels = []
     ip_inc = settings.get('ip_inc', 1)
 
     # find labels
     updated_lines = []
-    offset = 0
+    offsets = {}
     for line in lines:
         text = line.text.strip()
         if text.endswith(':'):
             label = text.split(':')[0].strip().split(' ')[0].strip()
+            offset = offsets.get(line.bank, 0)
 
             if label.startswith('.'):
                 # dot labels can be redefined
                 dot_labels[label.lstrip('.')] = line.addr - (offset * ip_inc)
+                all_dot_labels.append(
+                        (label.lstrip('.'), dot_labels[label.lstrip('.')]))
             else:
                 # normal labels can't
                 if label in labels:
                     raise DuplicateLabelException(label, line)
                 labels[label] = line.addr - (offset * ip_inc)
-            offset += 1
+            offsets[line.bank] = offset + 1
 
             if line.comment:
                 line.text = ''
@@ -251,8 +670,25 @@ def labels(lines, settings):
         for label, addr in labels.items():
             line.text = line.text.replace('@' + label, str(addr))
 
+    # keep the symbol table around for later stages, without the backticks
+    # added by constants and without the hardcoded address lines
+    settings['labels'] = {label.replace('`', ''): addr
+            for label, addr in labels.items() if not label.startswith('[')}
+    settings['dot_labels'] = [(label.replace('`', ''), addr)
+            for label, addr in all_dot_labels]
+
     return updated_lines
 
+@processor
+def address_overflow(lines, settings):
+    bank_size = settings.get('bank_size', 256)
+    limits = settings.get('bank_limits', {})
+    for line in lines:
+        limit = min(bank_size, limits.get(line.bank, bank_size))
+        if line.has_addr() and line.addr >= limit:
+            raise AddressOverflowException(line, limit)
+    return lines
+
 @processor
 def concatenated_bare_numbers(lines, _):
     def process(part):
@@ -277,10 +713,12 @@ def concatenated_bare_numbers(lines, _):
 @processor
 def format_as_verilog(lines, _):
     for line in lines:
+        if line.padding:
+            continue
         if line.has_addr() or not line.hard_addr is None:
+            line.code = line.text.strip().rstrip(';')
             line.text = '\t\t%s: data = %s;' % (
-                    line.hard_addr or str(line.addr),
-                    line.text.strip().rstrip(';'))
+                    line.hard_addr or str(line.addr), line.code)
     return lines
 
 @processor
@@ -293,18 +731,82 @@ def readd_comments(lines, _):
                 line.text = '\t\t// %s' % line.comment
     return lines
 
+@processor
+def stable_layout(lines, settings):
+    # one line per word in address order, so that changing a word changes
+    # only its own line of the output
+    if not settings.get('stable'):
+        return lines
+    words = [line for line in lines if not line.code is None]
+
+    def first_addr(line):
+        if line.hard_addr is None:
+            return line.addr
+        return min(parse_addresses(line.hard_addr))
+
+    return sorted(words, key=lambda line: (line.bank, first_addr(line)))
+
+
+#####
+# Input
+##
+
+def read_lines(path, keep_blank_lines=True, encoding='utf-8'):
+    """Read the lines of a source file without loading it as one string.
+
+    Regular files are memory mapped and split on the raw bytes, only the
+    lines that are kept get decoded. Pipes and other streams can't be
+    mapped, they are read into a bytes buffer instead. Lines which are just
+    a discarded (#) comment never become Line objects, neither do blank
+    lines unless keep_blank_lines is set (they show up as empty lines in
+    the output).
+    """
+    with open(path, 'rb') as fp:
+        info = os.fstat(fp.fileno())
+        if not stat.S_ISREG(info.st_mode):
+            return scan_lines(fp.read(), keep_blank_lines, encoding)
+        if info.st_size == 0:
+            return scan_lines(b'', keep_blank_lines, encoding)
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return scan_lines(data, keep_blank_lines, encoding)
+
+def scan_lines(data, keep_blank_lines, encoding):
+    lines = []
+    linenum = 0
+    start = 0
+    end = len(data)
+    while start <= end:
+        stop = data.find(b'\n', start)
+        if stop == -1:
+            stop = end
+        raw = data[start:stop]
+        stripped = raw.strip()
+        if stripped.startswith(b'#'):
+            pass
+        elif stripped or keep_blank_lines:
+            lines.append(Line(linenum, raw.decode(encoding)))
+        linenum += 1
+        start = stop + 1
+    return lines
+
 
 #####
 # Compilation entry point
 ##
 
-def compile(assembly, **settings):
-    output = []
-    output.append('always @(addr) begin')
-    output.append('\tcase (addr)')
+def assemble(assembly, **settings):
+    """Run every processor over the assembly.
 
-    # split assembly code into lines with line numbers
-    lines = list(map(lambda a: Line(*a), enumerate(assembly.split('\n'))))
+    The assembly is either source text or a list of Lines (see
+    read_lines()). Returns the processed lines along with the settings
+    dict, which the processors fill in with the symbol table ('labels' and
+    'dot_labels').
+    """
+    if isinstance(assembly, str):
+        # split assembly code into lines with line numbers
+        lines = list(map(lambda a: Line(*a), enumerate(assembly.split('\n'))))
+    else:
+        lines = list(assembly)
 
     # apply all processors
     if DEBUG:
@@ -316,9 +818,17 @@ def compile(assembly, **settings):
             print('## ran processor:', proc.__name__)
             list(map(print, map(repr, lines)))
 
+    return lines, settings
+
+def format_rom(lines):
+    output = []
+    output.append('always @(addr) begin')
+    output.append('\tcase (addr)')
+
     # add lines to output
     for line in lines:
-        output.append(line.text)
+        if not line.padding:
+            output.append(line.text)
 
     output.append('')
     output.append('\t\tdefault: data = 35\'b0;')
@@ -326,6 +836,79 @@ def compile(assembly, **settings):
     output.append('end')
     return '\n'.join(output)
 
+def single_bank(lines):
+    """Raise MultipleBanksException unless lines fit in one ROM image."""
+    banks = sorted(set(line.bank for line in lines))
+    if len(banks) > 1:
+        raise MultipleBanksException(banks)
+    return lines
+
+def compile(assembly, **settings):
+    lines, _ = assemble(assembly, **settings)
+    return format_rom(single_bank(lines))
+
+def compile_banks(assembly, **settings):
+    """Compile a program spread over several ROM banks.
+
+    Returns a {bank: verilog} dict, one case block per bank.
+    """
+    lines, _ = assemble(assembly, **settings)
+    banks = sorted(set(line.bank for line in lines)) or [0]
+    return {bank: format_rom([line for line in lines if line.bank == bank])
+            for bank in banks}
+
+
+def manifest(lines, settings):
+    """Describe the contents of the ROM for incremental builds.
+
+    Holds a content hash of every word ('banks' -> bank -> addr -> hash)
+    and the address and source hash of every routine, which can be passed
+    back as the 'pins' setting of the next build.
+    """
+    banks = {}
+    for line in lines:
+        if line.code is None:
+            continue
+        if line.hard_addr is None:
+            addrs = [line.addr]
+        else:
+            addrs = parse_addresses(line.hard_addr)
+        for addr in addrs:
+            banks.setdefault(str(line.bank), {})[str(addr)] = \
+                    content_hash(' '.join(line.code.split()))
+    return {
+        'ip_inc': settings.get('ip_inc', 1),
+        'banks': banks,
+        'routines': settings['routines'],
+    }
+
+def compile_stable(assembly, previous=None, **settings):
+    """Compile with a stable layout for incremental downstream builds.
+
+    Every word gets one line in address order and routines whose source is
+    unchanged since the previous manifest keep their addresses. Returns a
+    {bank: verilog} dict and the new manifest.
+    """
+    if previous:
+        settings.setdefault('pins', previous['routines'])
+    lines, settings = assemble(assembly, stable=True, **settings)
+    banks = sorted(set(line.bank for line in lines)) or [0]
+    roms = {bank: format_rom([line for line in lines if line.bank == bank])
+            for bank in banks}
+    return roms, manifest(lines, settings)
+
+def changed_words(previous, current):
+    """Return the (bank, addr) of every word that differs between two
+    manifests."""
+    changed = set()
+    for bank in set(previous['banks']) | set(current['banks']):
+        old = previous['banks'].get(bank, {})
+        new = current['banks'].get(bank, {})
+        for addr in set(old) | set(new):
+            if old.get(addr) != new.get(addr):
+                changed.add((int(bank), int(addr)))
+    return sorted(changed)
+
 
 #####
 # Main entry point
@@ -333,8 +916,11 @@ def compile(assembly, **settings):
 def main():
     prog, *args = sys.argv
 
+    stable = '--stable' in args
+    args = [arg for arg in args if arg != '--stable']
+
     if len(args) < 1:
-        print('usage: %s PATH [IP_INC]' % prog)
+        print('usage: %s [--stable] PATH [IP_INC]' % prog)
         return
 
     ip_inc = 1
@@ -344,8 +930,30 @@ def main():
         except ValueError:
             pass
 
-    with open(args[0]) as fp:
-        sys.stdout.write(compile(fp.read(), ip_inc=ip_inc))
+    if stable:
+        # keep a manifest next to the source to pin routines between builds
+        path = '%s.manifest.json' % os.path.splitext(args[0])[0]
+        previous = None
+        if os.path.exists(path):
+            with open(path) as fp:
+                previous = json.load(fp)
+        roms, current = compile_stable(read_lines(args[0]), previous,
+                ip_inc=ip_inc)
+        with open(path, 'w') as fp:
+            json.dump(current, fp, indent=1, sort_keys=True)
+    else:
+        roms = compile_banks(read_lines(args[0]), ip_inc=ip_inc)
+
+    if len(roms) == 1:
+        sys.stdout.write(list(roms.values())[0])
+        return
+
+    # one file per bank next to the source
+    for bank, rom in sorted(roms.items()):
+        path = '%s.bank%d.v' % (os.path.splitext(args[0])[0], bank)
+        with open(path, 'w') as fp:
+            fp.write(rom)
+        print(path)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,270 @@
+#!python3
+
+"""Differential testing of assembler engines against the reference pipeline.
+
+The original text based `compile()` (the processors pipeline, quirks
+included), frozen in legacy.py, is the reference. Every engine, including
+the current compile.py pipeline, has to produce byte for byte the same output
+for randomly generated and corpus programs, while the harness measures how
+much faster and leaner it is.
+"""
+
+import os
+import sys
+import glob
+import random
+import tempfile
+import time
+import tracemalloc
+
+import legacy
+from compile import compile, compile_banks, read_lines
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+#####
+# Engines
+##
+
+# every engine compiles the source file at path, just like compile.py would
+
+def reference(path, **settings):
+    with open(path) as fp:
+        return legacy.compile(fp.read(), **settings)
+
+def text_engine(path, **settings):
+    with open(path) as fp:
+        return compile(fp.read(), **settings)
+
+def mmap_engine(path, **settings):
+    return compile(read_lines(path), **settings)
+
+def banks_engine(path, **settings):
+    with open(path) as fp:
+        roms = compile_banks(fp.read(), **settings)
+    return roms[0] if list(roms) == [0] else roms
+
+ENGINES = {
+    'text': text_engine,
+    'mmap': mmap_engine,
+    'banks': banks_engine,
+}
+
+
+#####
+# Programs
+##
+
+# snippets exercising the quirks the reference has to keep
+QUIRKS = {
+    'negative numbers': '{a, -10, b}\n{a, --10, b}\n{a, ---10, b}',
+    'dot labels': '.loop:\n    a\n    jmp(@loop)\n.loop:\n    jmp(@loop)',
+    'kept comments': 'label: // on a label\n    a // on code\n// alone',
+    'discarded comments': 'a # gone\n# gone // kept?\nb',
+    'hex numbers': 'jmp(0xFF)\njmp(0xfg)\n[0x10]:\n    a',
+    'defines': 'x = 0x10\ny = $x\n{a, $y, b}',
+    'semicolons': 'a;\n;\n{a, 1, b};',
+}
+
+def corpus(paths=None):
+    """Return {name: source} of the quirk snippets and .asm files."""
+    cases = dict(QUIRKS)
+    for path in paths or glob.glob(os.path.join(HERE, '*.asm')):
+        with open(path) as fp:
+            cases[os.path.basename(path)] = fp.read()
+    return cases
+
+def random_program(rng, size=50):
+    """Generate a random program mixing every feature of the assembler."""
+    lines = []
+    labels = []
+    defines = []
+
+    def number():
+        return rng.choice([
+            str(rng.randint(0, 255)),
+            '-' * rng.randint(1, 3) + str(rng.randint(0, 128)),
+            '0x%02x' % rng.randint(0, 255),
+            '8\'b%s' % ''.join(rng.choice('01') for _ in range(8)),
+        ])
+
+    def operand():
+        choices = [number(), rng.choice(['DINP', 'GOUT', 'DOUT', 'FLAG'])]
+        if labels:
+            choices.append('@' + rng.choice(labels))
+        if defines:
+            choices.append('$' + rng.choice(defines))
+        return rng.choice(choices)
+
+    def comment():
+        return rng.choice(['', '', ' # discarded %d' % rng.randint(0, 9),
+            ' // kept %d' % rng.randint(0, 9)])
+
+    for index in range(size):
+        kind = rng.choice(['code'] * 6 + ['label', 'dot', 'define', 'blank',
+            'comment', 'hard'])
+        indent = rng.choice(['', '    ', '\t'])
+        if kind == 'label':
+            labels.append('label%d' % index)
+            lines.append('label%d:%s' % (index, comment()))
+        elif kind == 'dot':
+            lines.append('%s.loop:%s' % (indent, comment()))
+            labels.append('loop')
+        elif kind == 'define':
+            defines.append('define%d' % index)
+            lines.append('define%d = %s' % (index, number()))
+        elif kind == 'blank':
+            lines.append(indent)
+        elif kind == 'comment':
+            lines.append(indent + rng.choice(['#', '//']) + ' note')
+        elif kind == 'hard':
+            lines.append('[%d]:' % rng.randint(200, 255))
+            lines.append('%sjmp(%s)%s' % (indent, operand(), comment()))
+        else:
+            code = rng.choice([
+                '{JMP, EQ, REG, %s, NUM, %s, %s}' % (
+                    operand(), operand(), operand()),
+                '{MOV, PUR, NUM, %s, REG, %s, N8}' % (operand(), operand()),
+                'acc(UAD, %s, %s)' % (operand(), operand()),
+                'jmp(%s)' % operand(),
+                '35\'b0',
+            ])
+            lines.append('%s%s%s%s' % (
+                    indent, code, rng.choice(['', ';']), comment()))
+    return '\n'.join(lines)
+
+
+#####
+# Harness
+##
+
+class Result:
+
+    def __init__(self, case, engine, identical, detail, reference_time,
+            engine_time, reference_memory, engine_memory):
+        self.case = case
+        self.engine = engine
+        self.identical = identical
+        self.detail = detail
+        self.reference_time = reference_time
+        self.engine_time = engine_time
+        self.reference_memory = reference_memory
+        self.engine_memory = engine_memory
+
+    @property
+    def speedup(self):
+        return self.reference_time / max(self.engine_time, 1e-9)
+
+    @property
+    def memory_difference(self):
+        return self.engine_memory - self.reference_memory
+
+def measure(function, path, settings, repeat):
+    """Run function, returns (output or exception, seconds, peak bytes)."""
+    tracemalloc.start()
+    try:
+        try:
+            output = function(path, **settings)
+        except Exception as e:
+            output = e
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        try:
+            function(path, **settings)
+        except Exception:
+            pass
+    return output, (time.perf_counter() - start) / repeat, peak
+
+def difference(expected, received):
+    if isinstance(expected, Exception) or isinstance(received, Exception):
+        # legacy.py has its own copies of the exception classes
+        if type(expected).__name__ == type(received).__name__:
+            return None
+        return 'expected %r, received %r' % (expected, received)
+    if expected == received:
+        return None
+    if not isinstance(received, str):
+        return 'expected text, received %r' % type(received).__name__
+    expected = expected.split('\n')
+    received = received.split('\n')
+    for linenum in range(max(len(expected), len(received))):
+        e = expected[linenum] if linenum < len(expected) else '<missing>'
+        r = received[linenum] if linenum < len(received) else '<missing>'
+        if e != r:
+            return 'line %d: expected %r, received %r' % (linenum, e, r)
+
+def run(cases, engines=None, repeat=3, **settings):
+    """Check every engine against the reference on every case.
+
+    cases is a {name: source} dict, engines a {name: function(path)} dict
+    which defaults to ENGINES. Returns a list of Results.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for index, (case, assembly) in enumerate(cases.items()):
+            path = os.path.join(directory, '%d.asm' % index)
+            with open(path, 'wb') as fp:
+                fp.write(assembly.encode('utf-8'))
+
+            expected, reference_time, reference_memory = measure(
+                    reference, path, settings, repeat)
+            for engine, function in (engines or ENGINES).items():
+                received, engine_time, engine_memory = measure(
+                        function, path, settings, repeat)
+                detail = difference(expected, received)
+                results.append(Result(case, engine, detail is None, detail,
+                    reference_time, engine_time,
+                    reference_memory, engine_memory))
+    return results
+
+def report(results):
+    width = max([len(r.case) for r in results] + [len('case')])
+    template = '%-' + str(width) + 's  %-8s  %-4s  %7s  %10s'
+    output = [template % ('case', 'engine', 'same', 'speedup', 'memory')]
+    for result in results:
+        output.append(template % (result.case, result.engine,
+            'yes' if result.identical else 'NO', '%.2fx' % result.speedup,
+            '%+d' % result.memory_difference))
+    for result in results:
+        if not result.identical:
+            output.append('')
+            output.append('%s (%s): %s' % (
+                result.case, result.engine, result.detail))
+    return '\n'.join(output)
+
+
+#####
+# Main entry point
+##
+def main():
+    prog, *args = sys.argv
+
+    count = 20
+    seed = 0
+    try:
+        if len(args) > 0:
+            count = int(args[0])
+        if len(args) > 1:
+            seed = int(args[1])
+    except ValueError:
+        print('usage: %s [COUNT] [SEED]' % prog)
+        return
+
+    rng = random.Random(seed)
+    cases = corpus()
+    for index in range(count):
+        cases['random %d' % index] = random_program(rng)
+
+    results = run(cases)
+    print(report(results))
+    if not all(result.identical for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
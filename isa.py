@@ -0,0 +1,269 @@
+"""Instruction set description for the DSD project 1 CPU.
+
+Decodes the Verilog the assembler emits (concatenations of `CPU.vh` macros,
+sized numbers, raw 35 bit literals and the usual helper functions) back into
+instruction fields so that the assembled program can be analysed or run.
+"""
+
+import re
+from collections import namedtuple
+
+ADDR_SPACE = 256
+WORD_BITS = 35
+
+#####
+# Instruction layout
+##
+
+FIELDS = ('opcode', 'func', 'type1', 'op1', 'type2', 'op2', 'dest')
+WIDTHS = (4, 3, 2, 8, 2, 8, 8)
+
+# (width, value) of every macro in CPU.vh, keep in sync with the header
+MACROS = {
+    # instruction types
+    'NOP': (4, 0), 'JMP': (4, 1), 'MOV': (4, 2), 'ACC': (4, 3), 'ATC': (4, 4),
+    # jump conditions
+    'UNC': (3, 0), 'EQ': (3, 1), 'ULT': (3, 2), 'SLT': (3, 3), 'ULE': (3, 4),
+    'SLE': (3, 5),
+    # move functions
+    'PUR': (3, 0), 'SHL': (3, 1), 'SHR': (3, 2),
+    # accumulate functions
+    'UAD': (3, 0), 'SAD': (3, 1), 'UMT': (3, 2), 'SMT': (3, 3), 'AND': (3, 4),
+    'OR': (3, 5), 'XOR': (3, 6),
+    # operand types
+    'NUM': (2, 0), 'REG': (2, 1), 'IND': (2, 2),
+    # unused operands
+    'N8': (8, 0), 'N10': (10, 0),
+    # special registers, BANK selects the ROM bank (see compile.far_stubs())
+    # and has to be a register programs don't use otherwise
+    'BANK': (8, 27), 'DINP': (8, 28), 'GOUT': (8, 29), 'DOUT': (8, 30),
+    'FLAG': (8, 31),
+    # flag bits
+    'DVAL': (3, 0), 'SHFT': (3, 1), 'OFLW': (3, 2), 'SMPL': (3, 3),
+}
+
+OPCODES = ('NOP', 'JMP', 'MOV', 'ACC', 'ATC')
+CONDITIONS = ('UNC', 'EQ', 'ULT', 'SLT', 'ULE', 'SLE')
+
+
+#####
+# Exceptions
+##
+
+class UnknownInstructionException(Exception):
+    def __init__(self, text, reason):
+        super().__init__('\'%s\', %s' % (text, reason))
+
+
+#####
+# Instruction class
+##
+
+class Instruction(namedtuple('Instruction', FIELDS)):
+    __slots__ = ()
+
+    @property
+    def name(self):
+        if self.opcode < len(OPCODES):
+            return OPCODES[self.opcode]
+        return 'OP%d' % self.opcode
+
+    def encode(self):
+        word = 0
+        for value, width in zip(self, WIDTHS):
+            word = (word << width) | (value & ((1 << width) - 1))
+        return word
+
+    @classmethod
+    def decode(cls, word):
+        values = []
+        for width in reversed(WIDTHS):
+            values.append(word & ((1 << width) - 1))
+            word >>= width
+        return cls(*reversed(values))
+
+    def is_jump(self):
+        return self.name in ('JMP', 'ATC')
+
+    def is_conditional(self):
+        return self.name == 'ATC' or (self.name == 'JMP' and self.func != 0)
+
+NOP = Instruction(0, 0, 0, 0, 0, 0, 0)
+
+
+#####
+# Parsing
+##
+
+def parse_number(text):
+    """Parse a (possibly sized and negated) Verilog number.
+
+    Returns (value, width), width is None for unsized numbers.
+    """
+    text = text.replace(' ', '').replace('_', '')
+    sign = 1
+    while text.startswith('-'):
+        sign = -sign
+        text = text[1:]
+    if '\'' in text:
+        width, rest = text.split('\'', 1)
+        rest = rest.lstrip('sS')
+        base = {'b': 2, 'o': 8, 'd': 10, 'h': 16}[rest[0].lower()]
+        return sign * int(rest[1:], base), int(width) if width else None
+    return sign * int(text), None
+
+def parse_value(text):
+    """Parse a macro or a number, returns (value, width)."""
+    text = text.strip()
+    name = text.lstrip('`')
+    if name in MACROS:
+        width, value = MACROS[name]
+        return value, width
+    try:
+        return parse_number(text)
+    except (ValueError, KeyError, IndexError):
+        raise UnknownInstructionException(text, 'not a number or macro')
+
+def split_args(text):
+    args = []
+    depth = 0
+    current = ''
+    for char in text:
+        if char in '({':
+            depth += 1
+        elif char in ')}':
+            depth -= 1
+        if char == ',' and depth == 0:
+            args.append(current.strip())
+            current = ''
+        else:
+            current += char
+    if current.strip():
+        args.append(current.strip())
+    return args
+
+def from_fields(text, values):
+    if len(values) != len(FIELDS):
+        raise UnknownInstructionException(text, 'wrong number of fields')
+    return Instruction(*[
+        value & ((1 << width) - 1) for value, width in zip(values, WIDTHS)])
+
+def parse_concatenation(text):
+    word = 0
+    total = 0
+    for part in split_args(text.strip()[1:-1]):
+        value, width = parse_value(part)
+        if width is None:
+            raise UnknownInstructionException(text, 'unsized number')
+        word = (word << width) | (value & ((1 << width) - 1))
+        total += width
+    if total != WORD_BITS:
+        raise UnknownInstructionException(text, '%d bits wide' % total)
+    return Instruction.decode(word)
+
+def value_of(text):
+    return parse_value(text)[0]
+
+# helper functions commonly defined in ROM.v, expanded to instruction fields,
+# keep in sync with ROM.v (the README lists the definitions they assume)
+HELPERS = {
+    'jmp': lambda addr: ('JMP', 'UNC', 'N10', 0, 'N10', 0, addr),
+    'atc': lambda flag, addr: ('ATC', flag, 'N10', 0, 'N10', 0, addr),
+    'mov': lambda src, dst: ('MOV', 'PUR', 'REG', src, 'REG', dst, 'N8'),
+    'set': lambda reg, value: ('MOV', 'PUR', 'NUM', value, 'REG', reg, 'N8'),
+    'acc': lambda func, reg, value:
+        ('ACC', func, 'REG', reg, 'NUM', value, 'N8'),
+    'setBit': lambda reg, flag:
+        ('ACC', 'OR', 'REG', reg, 'NUM', 1 << value_of(flag), 'N8'),
+    'clearBit': lambda reg, flag:
+        ('ACC', 'AND', 'REG', reg, 'NUM', ~(1 << value_of(flag)), 'N8'),
+}
+
+def parse_helper(text):
+    name, args = text.split('(', 1)
+    name = name.strip()
+    if name not in HELPERS or not args.rstrip().endswith(')'):
+        raise UnknownInstructionException(text, 'unknown function')
+    try:
+        fields = HELPERS[name](*split_args(args.rstrip()[:-1]))
+    except TypeError:
+        raise UnknownInstructionException(text, 'wrong number of arguments')
+    return from_fields(text, [
+        field if isinstance(field, int) else value_of(str(field))
+        for field in fields])
+
+def parse(text):
+    """Parse the code of one ROM word into an Instruction."""
+    text = text.strip().rstrip(';').strip()
+    if text.startswith('{') and text.endswith('}'):
+        return parse_concatenation(text)
+    if re.match(r'^[A-Za-z_]\w*\s*\(', text):
+        return parse_helper(text)
+    value, width = parse_value(text)
+    if width != WORD_BITS:
+        raise UnknownInstructionException(text, 'not a 35 bit word')
+    return Instruction.decode(value)
+
+def parse_addresses(hard_addr):
+    """Parse the (comma separated) addresses of a hardcoded address line."""
+    try:
+        return [parse_number(addr)[0] for addr in hard_addr.split(',')]
+    except (ValueError, KeyError, IndexError):
+        raise UnknownInstructionException(hard_addr, 'not an address')
+
+
+#####
+# Semantics
+##
+
+def signed(value):
+    return value - 256 if value & 0x80 else value
+
+def compare(cond, a, b):
+    """Evaluate jump condition number cond on two 8 bit operands."""
+    name = CONDITIONS[cond] if cond < len(CONDITIONS) else None
+    if name == 'UNC':
+        return True
+    if name == 'EQ':
+        return a == b
+    if name == 'ULT':
+        return a < b
+    if name == 'SLT':
+        return signed(a) < signed(b)
+    if name == 'ULE':
+        return a <= b
+    if name == 'SLE':
+        return signed(a) <= signed(b)
+    return False
+
+
+#####
+# ROM image
+##
+
+def build_rom(lines):
+    """Build a {addr: (Instruction, Line)} image from the processed lines of
+    one bank (see compile.single_bank())."""
+    rom = {}
+    for line in lines:
+        if line.code is None:
+            continue
+        inst = parse(line.code)
+        if line.hard_addr is None:
+            addrs = [line.addr]
+        else:
+            addrs = parse_addresses(line.hard_addr)
+        for addr in addrs:
+            rom[addr] = (inst, line)
+    return rom
+
+def qualified_labels(labels, dot_labels):
+    """Return (addr, name) for every label, dot labels are prefixed with the
+    name of the label they're in."""
+    names = sorted((addr, name) for name, addr in labels.items())
+    for dot_label, addr in dot_labels:
+        outer = [name for start, name in names if start <= addr and
+                not '.' in name]
+        prefix = outer[-1] + '.' if outer else '.'
+        names.append((addr, prefix + dot_label))
+    return sorted(names, key=lambda n: (n[0], '.' in n[1]))
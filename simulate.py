@@ -0,0 +1,304 @@
+#!python3
+
+"""Instruction set simulator with a built in execution profiler.
+
+Runs an assembled program and keeps per address execution counts, taken and
+not taken counts of every conditional jump and the cycles spent under each
+label. The counters live in arrays allocated up front so that profiling
+doesn't slow down the simulation loop.
+"""
+
+import sys
+from array import array
+
+from compile import assemble, single_bank
+from isa import (ADDR_SPACE, MACROS, NOP, build_rom, compare, qualified_labels,
+        signed)
+from analyze import DEFAULT_CYCLES
+
+DINP = MACROS['DINP'][1]
+GOUT = MACROS['GOUT'][1]
+DOUT = MACROS['DOUT'][1]
+FLAG = MACROS['FLAG'][1]
+SHFT = 1 << MACROS['SHFT'][1]
+OFLW = 1 << MACROS['OFLW'][1]
+SMPL = 1 << MACROS['SMPL'][1]
+
+
+#####
+# Simulator
+##
+
+class Simulator:
+
+    def __init__(self, rom, labels=None, dot_labels=None, ip_inc=1,
+            cycles=None, inputs=()):
+        self.rom = rom
+        self.ip_inc = ip_inc
+        cycles = dict(DEFAULT_CYCLES, **(cycles or {}))
+
+        # predecode the whole address space, unused words read as 35'b0
+        self.program = [rom.get(addr, (NOP, None))[0]
+                for addr in range(ADDR_SPACE)]
+        self.costs = [cycles.get(inst.name, 1) for inst in self.program]
+
+        self.regs = array('B', bytes(ADDR_SPACE))
+        self.ip = 0
+        self.cycle = 0
+        self.inputs = iter(inputs)
+        self.input_pending = False
+        self.outputs = []
+
+        # every address belongs to the closest label before it, the last
+        # slot collects words that aren't under any label
+        symbols = qualified_labels(labels or {}, dot_labels or [])
+        self.label_names = [name for _, name in symbols]
+        self.owner = array('l', [len(symbols)] * ADDR_SPACE)
+        sequential = [addr for addr, (_, line) in rom.items()
+                if line.hard_addr is None]
+        for index, (start, _) in enumerate(symbols):
+            for addr in sequential:
+                if addr >= start:
+                    self.owner[addr] = index
+
+        # profile counters
+        self.counts = array('Q', bytes(8 * ADDR_SPACE))
+        self.taken = array('Q', bytes(8 * ADDR_SPACE))
+        self.not_taken = array('Q', bytes(8 * ADDR_SPACE))
+        self.label_cycles = array('Q', bytes(8 * (len(self.label_names) + 1)))
+
+    #####
+    # Registers
+    ##
+
+    def latch_input(self):
+        if not self.input_pending:
+            value = next(self.inputs, None)
+            if not value is None:
+                self.regs[DINP] = value & 0xFF
+                self.regs[FLAG] |= SMPL
+                self.input_pending = True
+
+    def read(self, reg):
+        if reg == DINP:
+            self.input_pending = False
+        return self.regs[reg]
+
+    def write(self, reg, value):
+        self.regs[reg] = value & 0xFF
+        if reg in (DOUT, GOUT):
+            self.outputs.append((self.cycle, reg, value & 0xFF))
+
+    def operand(self, kind, value):
+        if kind == 0:  # NUM
+            return value
+        if kind == 1:  # REG
+            return self.read(value)
+        return self.read(self.regs[value])  # IND
+
+    def target(self, kind, value):
+        return self.regs[value] if kind == 2 else value
+
+    #####
+    # Execution
+    ##
+
+    def step(self):
+        ip = self.ip
+        inst = self.program[ip]
+        cost = self.costs[ip]
+        self.counts[ip] += 1
+        self.label_cycles[self.owner[ip]] += cost
+        self.cycle += cost
+        self.latch_input()
+
+        following = (ip + self.ip_inc) % ADDR_SPACE
+        opcode = inst.opcode
+        if opcode == 1:  # JMP
+            a = self.operand(inst.type1, inst.op1)
+            b = self.operand(inst.type2, inst.op2)
+            if compare(inst.func, a, b):
+                following = inst.dest
+                self.taken[ip] += 1
+            else:
+                self.not_taken[ip] += 1
+        elif opcode == 2:  # MOV
+            self.move(inst)
+        elif opcode == 3:  # ACC
+            self.accumulate(inst)
+        elif opcode == 4:  # ATC
+            bit = 1 << inst.func
+            if self.regs[FLAG] & bit:
+                self.regs[FLAG] &= ~bit & 0xFF
+                following = inst.dest
+                self.taken[ip] += 1
+            else:
+                self.not_taken[ip] += 1
+        self.ip = following
+        return following
+
+    def move(self, inst):
+        value = self.operand(inst.type1, inst.op1)
+        if inst.func == 1:  # SHL
+            if value & 0x80:
+                self.regs[FLAG] |= SHFT
+            value <<= 1
+        elif inst.func == 2:  # SHR
+            if value & 0x01:
+                self.regs[FLAG] |= SHFT
+            value >>= 1
+        self.write(self.target(inst.type2, inst.op2), value)
+
+    def accumulate(self, inst):
+        reg = self.target(inst.type1, inst.op1)
+        a = self.read(reg)
+        b = self.operand(inst.type2, inst.op2)
+        func = inst.func
+        if func == 0:  # UAD
+            value = a + b
+            overflow = value > 0xFF
+        elif func == 1:  # SAD
+            value = signed(a) + signed(b)
+            overflow = not -128 <= value <= 127
+        elif func == 2:  # UMT
+            value = a * b
+            overflow = value > 0xFF
+        elif func == 3:  # SMT
+            value = signed(a) * signed(b)
+            overflow = not -128 <= value <= 127
+        else:
+            value = {4: a & b, 5: a | b, 6: a ^ b}.get(func, a)
+            overflow = False
+        if overflow:
+            self.regs[FLAG] |= OFLW
+        self.write(reg, value)
+
+    def is_halted(self):
+        inst = self.program[self.ip]
+        return inst.opcode == 1 and inst.func == 0 and inst.dest == self.ip
+
+    def run(self, max_cycles=100000):
+        """Run until the program halts (jumps to itself) or max_cycles pass.
+
+        Returns True if the program halted.
+        """
+        while self.cycle < max_cycles:
+            if self.is_halted():
+                self.step()
+                return True
+            self.step()
+        return False
+
+    #####
+    # Reports
+    ##
+
+    def name_of(self, addr):
+        index = self.owner[addr]
+        if index < len(self.label_names):
+            return self.label_names[index]
+        return ''
+
+    def hot_spots(self):
+        """Return (addr, count, cycles, label) sorted by cycles spent."""
+        spots = [(addr, self.counts[addr], self.counts[addr] * self.costs[addr],
+                self.name_of(addr))
+                for addr in range(ADDR_SPACE) if self.counts[addr]]
+        return sorted(spots, key=lambda s: (-s[2], s[0]))
+
+    def label_profile(self):
+        """Return (label, cycles) sorted by cycles spent."""
+        names = self.label_names + ['<unlabelled>']
+        profile = [(name, cycles)
+                for name, cycles in zip(names, self.label_cycles) if cycles]
+        return sorted(profile, key=lambda p: -p[1])
+
+    def branches(self):
+        """Return (addr, taken, not taken) for every conditional jump."""
+        return [(addr, self.taken[addr], self.not_taken[addr])
+                for addr in sorted(self.rom)
+                if self.program[addr].is_conditional()]
+
+    def never_executed(self):
+        return [addr for addr in sorted(self.rom) if not self.counts[addr]]
+
+    def report(self, limit=10):
+        output = ['cycles: %d' % self.cycle, '', 'hot spots:']
+        for addr, count, cycles, name in self.hot_spots()[:limit]:
+            output.append('\t%5d  %8d  %8d  %s' % (addr, count, cycles, name))
+
+        output.append('')
+        output.append('labels:')
+        for name, cycles in self.label_profile():
+            output.append('\t%8d  %s' % (cycles, name))
+
+        output.append('')
+        output.append('branches (taken/not taken):')
+        for addr, taken, not_taken in self.branches():
+            output.append('\t%5d  %8d  %8d  %s' % (
+                    addr, taken, not_taken, self.name_of(addr)))
+
+        output.append('')
+        output.append('never executed:')
+        for addr in self.never_executed():
+            output.append('\t%5d  %s' % (addr, self.name_of(addr)))
+        return '\n'.join(output)
+
+    def listing(self, assembly):
+        """Annotate the source with the execution count of every line."""
+        counts = {}
+        for addr, (_, line) in self.rom.items():
+            counts[line.linenum] = counts.get(line.linenum, 0) + \
+                    self.counts[addr]
+        output = []
+        for linenum, text in enumerate(assembly.split('\n')):
+            count = counts.get(linenum)
+            if count is None:
+                output.append('%8s  %s' % ('', text))
+            elif count:
+                output.append('%8d  %s' % (count, text))
+            else:
+                output.append('%8s  %s' % ('#####', text))
+        return '\n'.join(output)
+
+
+#####
+# Simulation entry point
+##
+
+def simulate(assembly, inputs=(), cycles=None, max_cycles=100000,
+        **settings):
+    lines, settings = assemble(assembly, **settings)
+    simulator = Simulator(build_rom(single_bank(lines)), settings['labels'],
+            settings['dot_labels'], settings.get('ip_inc', 1), cycles, inputs)
+    simulator.run(max_cycles)
+    return simulator
+
+
+#####
+# Main entry point
+##
+def main():
+    prog, *args = sys.argv
+
+    if len(args) < 1:
+        print('usage: %s PATH [IP_INC]' % prog)
+        return
+
+    ip_inc = 1
+    if len(args) > 1:
+        try:
+            ip_inc = int(args[1])
+        except ValueError:
+            pass
+
+    with open(args[0]) as fp:
+        assembly = fp.read()
+    simulator = simulate(assembly, ip_inc=ip_inc)
+    print(simulator.report())
+    print()
+    print(simulator.listing(assembly))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+#!python3
+
+import pytest
+
+from analyze import analyze
+from compile import MultipleBanksException
+from isa import parse, Instruction, UnknownInstructionException
+
+
+#####
+# Helpers
+###
+
+def bounds_of(analysis):
+    return {r.name: (r.entry, r.best, r.worst) for r in analysis.results}
+
+
+#####
+# Tests
+###
+
+def test_parse():
+    assert parse('{`JMP, `EQ, `NUM, -8\'d5, `NUM, 8\'d9, 8\'d3}') == \
+            Instruction(1, 1, 0, 251, 0, 9, 3)
+    assert parse('jmp(12)') == parse('{`JMP, `UNC, `N10, `N10, 8\'d12}')
+    assert parse('setBit(`GOUT, `DVAL)') == \
+            parse('{`ACC, `OR, `REG, `GOUT, `NUM, 8\'b1, `N8}')
+    word = parse('35\'b0010_000_00_10001000_01_00011110_00000000')
+    assert Instruction.decode(word.encode()) == word
+    with pytest.raises(UnknownInstructionException):
+        parse('{`JMP, `UNC}')
+    with pytest.raises(UnknownInstructionException):
+        parse('frobnicate(1)')
+
+def test_straight_line():
+    analysis = analyze('''
+    main:
+        set(DOUT, 1)
+        acc(UAD, DOUT, 1)
+        jmp(@next)
+    next:
+        jmp(@next)
+    ''')
+    assert bounds_of(analysis) == {
+        '<reset>': (0, 4, 4),
+        'main': (0, 3, 3),
+        'next': (3, 1, 1),
+    }
+    assert analysis.halts == [3]
+    assert analysis.loops == []
+
+def test_branches():
+    analysis = analyze('''
+    main:
+        {JMP, EQ, REG, DINP, NUM, 0, @skip}
+        set(DOUT, 1)
+        set(DOUT, 2)
+        .again:
+            acc(UAD, DOUT, 1)
+            {JMP, ULT, REG, DOUT, NUM, 0, @again}
+    skip:
+        jmp(@skip)
+    ''')
+    result = bounds_of(analysis)
+    assert result['main'] == (0, 1, None)
+    assert analysis.loops == [[3, 4]]
+    analysis = analyze('''
+    main:
+        {JMP, EQ, REG, DINP, NUM, 0, @skip}
+        set(DOUT, 1)
+        set(DOUT, 2)
+        .inc:
+            acc(UAD, DOUT, 1)
+    skip:
+        jmp(@skip)
+    ''')
+    result = bounds_of(analysis)
+    assert result['main'] == (0, 1, 4)
+    assert result['main.inc'] == (3, 1, 1)
+    assert analysis.results[1].worst_path == [0, 1, 2, 3]
+
+def test_constant_conditions():
+    analysis = analyze('''
+    main:
+        {JMP, EQ, NUM, 25, NUM, 50, @main} # never taken
+        {JMP, SLT, NUM, -5, NUM, 5, @done} # always taken
+        set(DOUT, 1)
+    done:
+        jmp(@done)
+    ''')
+    assert bounds_of(analysis)['main'] == (0, 2, 2)
+    assert analysis.loops == []
+
+def test_unbounded_loops():
+    analysis = analyze('''
+    main:
+        .wait:
+            atc(SMPL, @read)
+            jmp(@wait)
+    read:
+        mov(DINP, DOUT)
+        jmp(@main)
+    ''')
+    result = bounds_of(analysis)
+    assert result['main'] == (0, 1, None)
+    assert result['main.wait'] == (0, 1, None)
+    assert result['read'] == (2, 2, 2)
+    assert analysis.loops == [[0, 1, 2, 3]]
+    assert 'unbounded' in analysis.report()
+    assert [r.name for r in analysis.over_budget({'main': 100})] == ['main']
+
+def test_ip_inc_and_hardcoded_addresses():
+    analysis = analyze('''
+    main:
+        set(DOUT, 1)
+        jmp(255)
+    [0xFF]:
+        jmp(0xFF)
+    ''', ip_inc=4)
+    assert bounds_of(analysis) == {
+        '<reset>': (0, 3, 3),
+        'main': (0, 2, 2),
+    }
+    assert analysis.halts == [255]
+    assert analysis.over_budget({'main': 2}) == []
+    analysis = analyze('''
+    main:
+        jmp(255)
+    [8'hFF]:
+        jmp(8'hFF)
+    ''')
+    assert analysis.halts == [255]
+    with pytest.raises(UnknownInstructionException):
+        analyze('''
+        [top]:
+            jmp(0)
+        ''')
+
+def test_cycles():
+    analysis = analyze('''
+    main:
+        set(DOUT, 1)
+        jmp(@main)
+    ''', cycles={'JMP': 3})
+    assert analysis.loops == [[0, 1]]
+    assert bounds_of(analysis)['main'] == (0, None, None)
+    analysis = analyze('''
+        set(DOUT, 1)
+        jmp(@end)
+    end:
+        jmp(@end)
+    ''', cycles={'JMP': 3})
+    assert bounds_of(analysis)['<reset>'] == (0, 7, 7)
+
+def test_multiple_banks():
+    with pytest.raises(MultipleBanksException):
+        analyze('''
+        main:
+            jmp(@far_away)
+        .bank 1
+        far_away:
+            jmp(@far_away)
+        ''')
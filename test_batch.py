@@ -0,0 +1,90 @@
+#!python3
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from batch import encode, decode, to_verilog, write_roms, \
+        FieldWidthException, FieldTypeException, UnknownMacroException
+from compile import compile
+from isa import Instruction, parse
+
+
+#####
+# Tests
+###
+
+def test_encode_matches_parser():
+    words = encode({
+        'opcode': ['JMP', 'MOV', 'ACC'],
+        'func': ['EQ', 'PUR', 'SMT'],
+        'type1': ['REG', 'NUM', 'REG'],
+        'op1': ['DINP', -25, 0],
+        'type2': ['NUM', 'REG', 'NUM'],
+        'op2': [7, 'DOUT', -2],
+        'dest': [12, 0, 0],
+    })
+    assert words.dtype == np.uint64
+    assert list(words) == [parse(text).encode() for text in [
+        '{`JMP, `EQ, `REG, `DINP, `NUM, 8\'d7, 8\'d12}',
+        '{`MOV, `PUR, `NUM, -8\'d25, `REG, `DOUT, `N8}',
+        '{`ACC, `SMT, `REG, 8\'d0, `NUM, -8\'d2, `N8}',
+    ]]
+
+def test_roundtrip():
+    rng = np.random.default_rng(0)
+    fields = np.zeros((4, 64), dtype=decode([0]).dtype)
+    for name, width in zip(fields.dtype.names, (4, 3, 2, 8, 2, 8, 8)):
+        fields[name] = rng.integers(0, 1 << width, fields.shape)
+    words = encode(fields)
+    assert words.shape == (4, 64)
+    assert (decode(words) == fields).all()
+    assert int(words[2, 5]) == Instruction(*fields[2, 5].tolist()).encode()
+
+def test_broadcasting():
+    # one ROM per row, every ROM loads a different value
+    words = encode({
+        'opcode': 'MOV', 'type1': 'NUM', 'type2': 'REG', 'op2': 'DOUT',
+        'op1': np.arange(3)[:, None] + np.zeros(2, dtype=int),
+    })
+    assert words.shape == (3, 2)
+    assert (decode(words)['op1'] == [[0, 0], [1, 1], [2, 2]]).all()
+
+def test_field_widths():
+    with pytest.raises(FieldWidthException) as e:
+        encode({'opcode': [1, 2, 16]})
+    assert 'opcode' in str(e.value) and '(2,)' in str(e.value)
+    with pytest.raises(FieldWidthException):
+        encode({'op1': [-129]})
+    for field in ('opcode', 'func', 'type1', 'type2'):
+        with pytest.raises(FieldWidthException):
+            encode({field: -1})
+    assert decode(encode({'dest': -1}))['dest'] == 255
+    with pytest.raises(KeyError):
+        encode({'opcodes': 1})
+    with pytest.raises(FieldTypeException):
+        encode({'op1': np.array([1.7])})
+    assert decode(encode({'op1': np.array([True])}))['op1'] == 1
+
+def test_unknown_macros():
+    with pytest.raises(UnknownMacroException) as e:
+        encode({'opcode': ['JMP', 'JUMP']})
+    assert 'opcode' in str(e.value) and 'JUMP' in str(e.value)
+
+def test_verilog_matches_compiler():
+    words = encode({'opcode': 'JMP', 'dest': [0, 4, 8]})
+    text = to_verilog(words, ip_inc=4)
+    assert '4: data = 35\'b0001_000_00_00000000_00_00000000_00000100;' in text
+    literals = [line.split('data = ')[1] for line in text.split('\n')
+            if 'data = 35\'b0001' in line]
+    assert text == compile('\n'.join(literals), ip_inc=4)
+    assert len(to_verilog(np.stack([words, words]))) == 2
+    assert to_verilog(encode({'opcode': 'JMP'})) == compile(
+            '35\'b0001_000_00_00000000_00_00000000_00000000')
+
+def test_write_roms(tmp_path):
+    words = encode({'opcode': 'NOP', 'dest': np.zeros((3, 5), dtype=int)})
+    paths = write_roms(words, str(tmp_path / 'rom%d.v'))
+    assert len(paths) == 3
+    with open(paths[1]) as fp:
+        assert fp.read() == to_verilog(words[1])
@@ -3,13 +3,20 @@
 import pytest
 from itertools import zip_longest
 
-from compile import compile, DuplicateLabelException, DuplicateDefineException
+import os
+
+from compile import compile, compile_banks, compile_stable, changed_words, \
+        read_lines, DuplicateLabelException, DuplicateDefineException, \
+        AddressOverflowException, MultipleBanksException, \
+        FarReferenceException, BankDirectiveException
 
 
 #####
 # Helpers
 ###
 
+HERE = os.path.dirname(os.path.abspath(__file__))
+
 skip = pytest.mark.skip()
 
 def find_max_width(text):
@@ -39,8 +46,12 @@ def print_as_columns(a, b):
 
 def compile_and_compare(assembly, expected_machine_code, **compiler_args):
     __tracebackhide__ = True
+    compare(compile(assembly, **compiler_args), expected_machine_code)
 
-    recieved_machine_code = compile(assembly, **compiler_args).strip('\n').replace('\t', '    ').rstrip()
+def compare(recieved_machine_code, expected_machine_code):
+    __tracebackhide__ = True
+
+    recieved_machine_code = recieved_machine_code.strip('\n').replace('\t', '    ').rstrip()
     expected_machine_code = expected_machine_code.strip('\n').replace('\t', '    ').rstrip()
 
     print_as_columns(
@@ -446,3 +457,313 @@ def test_mixed_label_types():
         endcase
     end
     ''')
+
+def test_address_overflow():
+    with pytest.raises(AddressOverflowException):
+        compile('a\n' * 257)
+    with pytest.raises(AddressOverflowException):
+        compile('a\n' * 65, ip_inc=4)
+    compile('a\n' * 64, ip_inc=4)
+
+def test_banks():
+    assembly = '''
+    main:
+        set(DOUT, 1)
+        jmp(@far_away)
+    back:
+        jmp(@back)
+
+    .bank 1
+    far_away:
+        set(DOUT, 2)
+        {JMP, EQ, REG, DINP, NUM, 0, @main}
+        jmp(@back)
+    '''
+    with pytest.raises(MultipleBanksException):
+        compile(assembly)
+    roms = compile_banks(assembly)
+    assert sorted(roms) == [0, 1]
+    compare(roms[0], '''
+    always @(addr) begin
+        case (addr)
+            0: data = set(`DOUT, 1);
+            1: data = jmp(254);
+            2: data = jmp(2);
+
+            251: data = {`JMP, `UNC, `N10, `N10, 8'd0};
+            253: data = {`JMP, `UNC, `N10, `N10, 8'd2};
+            254: data = {`MOV, `PUR, `NUM, 8'd1, `REG, `BANK, `N8};
+            255: data = {`JMP, `UNC, `N10, `N10, 8'd0};
+
+            default: data = 35\'b0;
+        endcase
+    end
+    ''')
+    compare(roms[1], '''
+    always @(addr) begin
+        case (addr)
+            0: data = set(`DOUT, 2);
+            1: data = {`JMP, `EQ, `REG, `DINP, `NUM, 8'd0, 8'd250};
+            2: data = jmp(252);
+            250: data = {`MOV, `PUR, `NUM, 8'd0, `REG, `BANK, `N8};
+            251: data = {`JMP, `UNC, `N10, `N10, 8'd0};
+            252: data = {`MOV, `PUR, `NUM, 8'd0, `REG, `BANK, `N8};
+            253: data = {`JMP, `UNC, `N10, `N10, 8'd2};
+            255: data = {`JMP, `UNC, `N10, `N10, 8'd0};
+
+            default: data = 35\'b0;
+        endcase
+    end
+    ''')
+
+def test_bank_directives():
+    roms = compile_banks('a\n.bank 01\nb\n.bank 2\nc')
+    assert sorted(roms) == [0, 1, 2]
+    for directive in ('.bank', '.bank foo', '.bank -1', '.bank 1 2'):
+        with pytest.raises(BankDirectiveException) as e:
+            compile_banks('a\n%s\nb' % directive)
+        assert 'line: 1' in str(e.value)
+
+def test_far_references():
+    # stubs avoid hardcoded addresses in both banks
+    roms = compile_banks('''
+    main:
+        atc(SMPL, @far_away)
+    [0xFF]:
+        jmp(0)
+    .bank 1
+    far_away:
+        jmp(@far_away)
+    [254]:
+        jmp(0)
+    ''')
+    assert '0: data = atc(`SMPL, 252);' in roms[0]
+    assert '252: data = {`MOV, `PUR, `NUM, 8\'d1, `REG, `BANK, `N8};' in roms[0]
+    assert '253: data = {`JMP, `UNC, `N10, `N10, 8\'d0};' in roms[0]
+    assert '253: data = {`JMP, `UNC, `N10, `N10, 8\'d0};' in roms[1]
+
+    # only the destination of a jump can be in another bank
+    with pytest.raises(FarReferenceException):
+        compile_banks('''
+        main:
+            set(0, @table)
+        .bank 1
+        table:
+            jmp(@table)
+        ''')
+    with pytest.raises(FarReferenceException):
+        compile_banks('''
+        main:
+            {JMP, EQ, NUM, @table, NUM, 0, @main}
+        .bank 1
+        table:
+            jmp(@table)
+        ''')
+
+    # code can't run into the stubs
+    with pytest.raises(AddressOverflowException):
+        compile_banks('main:\n' + 'a\n' * 255 + 'jmp(@far_away)\n'
+                '.bank 1\nfar_away:\njmp(@main)')
+
+def test_automatic_banks():
+    def routine(name, size, target):
+        return '%s:\n%s    jmp(@%s)\n' % (name, '    a\n' * size, target)
+    assembly = (routine('first', 100, 'third') + routine('second', 100, 'first')
+            + routine('third', 100, 'first'))
+    with pytest.raises(AddressOverflowException):
+        compile(assembly)
+
+    # first and third reference each other so they share a bank
+    roms = compile_banks(assembly, banking='auto')
+    assert sorted(roms) == [0, 1]
+    assert 'jmp(101)' in roms[0] and 'jmp(0)' in roms[0]
+    assert 'BANK' not in roms[0]
+    assert "`NUM, 8'd0, `REG, `BANK" in roms[1]
+
+    # unless the profile says that second is hot
+    roms = compile_banks(assembly, banking='auto', profile={'second': 1000})
+    assert roms[0].count('data = a;') == 200
+    assert roms[1].count('data = a;') == 100
+    assert "`NUM, 8'd1, `REG, `BANK" in roms[0]
+
+    # a label without code stays with the routine it falls through into
+    assembly = (routine('first', 100, 'body') + 'entry:\nbody:\n' +
+            '    a\n' * 100 + '    jmp(@first)\n' + routine('other', 100, 'entry'))
+    roms = compile_banks(assembly, banking='auto')
+    assert roms[0].count('data = a;') == 200
+    assert 'jmp(0)' not in roms[1]
+    assert "`NUM, 8'd0, `REG, `BANK" in roms[1]
+
+def test_read_lines(tmp_path):
+    with open(os.path.join(HERE, 'all-inst-test.asm')) as fp:
+        assembly = fp.read()
+    path = tmp_path / 'all-inst-test.asm'
+    path.write_bytes(assembly.encode('utf-8'))
+    assert compile(read_lines(str(path))) == compile(assembly)
+
+    path = tmp_path / 'test.asm'
+    path.write_bytes(b'''
+    # skipped
+    a // kept
+
+    [0xFF]:
+    # skipped
+        jmp(0xFF)
+    b # discarded''')
+    assert [line.linenum for line in read_lines(str(path))] == [0, 2, 3, 4, 6, 7]
+    compare(compile(read_lines(str(path), keep_blank_lines=False)), '''
+    always @(addr) begin
+        case (addr)
+            0: data = a; // kept
+            255: data = jmp(255);
+            1: data = b;
+
+            default: data = 35\'b0;
+        endcase
+    end
+    ''')
+
+    path = tmp_path / 'empty.asm'
+    path.write_bytes(b'')
+    assert compile(read_lines(str(path))) == compile('')
+
+@pytest.mark.skipif(not os.path.isdir('/dev/fd'), reason='needs /dev/fd')
+def test_read_lines_from_pipe():
+    read, write = os.pipe()
+    try:
+        os.write(write, b'a\n# skipped\nb\n')
+        os.close(write)
+        lines = read_lines('/dev/fd/%d' % read)
+    finally:
+        os.close(read)
+    assert compile(lines) == compile('a\nb\n')
+
+def test_stable_layout():
+    compile_and_compare('''
+    // dropped
+    first:
+        a // kept
+
+    [0x10]:
+        b
+    second:
+        c
+    ''', '''
+    always @(addr) begin
+        case (addr)
+            0: data = a; // kept
+            1: data = c;
+            16: data = b;
+
+            default: data = 35\'b0;
+        endcase
+    end
+    ''', stable=True)
+    roms, manifest = compile_stable('''
+    main:
+        a
+    [8'hFF]:
+        b
+    ''')
+    assert sorted(manifest['banks']['0']) == ['0', '255']
+    assert roms[0].index('0: data = a;') < roms[0].index("8'hFF: data = b;")
+
+def test_pinned_addresses():
+    compile_and_compare('''
+    first:
+        a
+        jmp(@second)
+    second:
+        b
+        jmp(@first)
+    ''', '''
+    always @(addr) begin
+        case (addr)
+            0: data = a;
+            4: data = jmp(40);
+            40: data = b;
+            44: data = jmp(0);
+
+            default: data = 35\'b0;
+        endcase
+    end
+    ''', ip_inc=4, pins={'second': 40}, stable=True)
+
+def test_manifest():
+    def program(middle):
+        return '''
+        reset:
+            jmp(@first)
+        first:
+            %s
+            jmp(@second)
+        second:
+            b
+            jmp(@second)
+        ''' % middle
+
+    roms, manifest = compile_stable(program('a'))
+    assert manifest['routines']['second'][0] == 3
+    assert sorted(manifest['banks']['0']) == ['0', '1', '2', '3', '4']
+
+    # the same program doesn't change at all
+    again, unchanged = compile_stable(program('a'), manifest)
+    assert again == roms and unchanged == manifest
+
+    # a changed instruction only changes its own word
+    _, changed = compile_stable(program('c'), manifest)
+    assert changed_words(manifest, changed) == [(0, 1)]
+
+    # a growing routine moves out of the way of the unchanged ones
+    roms, grown = compile_stable(program('a\n            a'), manifest)
+    assert grown['routines']['second'][0] == 3
+    assert grown['routines']['first'][0] == 5
+    assert changed_words(manifest, grown) == [(0, 0), (0, 1), (0, 2), (0, 5),
+            (0, 6), (0, 7)]
+    compare(roms[0], '''
+    always @(addr) begin
+        case (addr)
+            0: data = jmp(5);
+            3: data = b;
+            4: data = jmp(3);
+            5: data = a;
+            6: data = a;
+            7: data = jmp(3);
+
+            default: data = 35\'b0;
+        endcase
+    end
+    ''')
+
+def test_pins_dropped_on_overflow():
+    def program(size):
+        return 'reset:\n    jmp(@first)\nfirst:\n' + '    a\n' * size + \
+                '    jmp(@second)\nsecond:\n' + '    b\n' * 120 + \
+                '    jmp(@second)\n'
+
+    # 247 words, growing by one doesn't fit with second kept in place
+    _, manifest = compile_stable(program(124))
+    assert manifest['routines']['second'][0] == 126
+    roms, grown = compile_stable(program(125), manifest)
+    assert grown['routines']['second'][0] == 127
+    assert roms[0] == compile(program(125))
+
+def test_pins_avoid_hardcoded_addresses():
+    def program(size):
+        return 'main:\n    jmp(@b)\nb:\n' + '    a\n' * size + \
+                '    jmp(@c)\nc:\n    jmp(@c)\n[10]:\n    jmp(10)\n'
+
+    _, manifest = compile_stable(program(2))
+    roms, grown = compile_stable(program(5), manifest)
+    assert grown['routines']['c'][0] == manifest['routines']['c'][0]
+    assert grown['routines']['b'][0] == 11
+    addrs = [line.split(':')[0].strip() for line in roms[0].split('\n')
+            if 'data =' in line]
+    assert len(addrs) == len(set(addrs))
+    assert '10: data = jmp(10);' in roms[0]
+    assert '16: data = jmp(4);' in roms[0]
+
+    # with ip_inc the whole slot of a hardcoded word is taken
+    _, manifest = compile_stable(program(2), ip_inc=4)
+    roms, _ = compile_stable(program(5), manifest, ip_inc=4)
+    assert '20: data = a;' in roms[0] and not '\t8: data' in roms[0]
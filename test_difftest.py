@@ -0,0 +1,40 @@
+#!python3
+
+import random
+
+import difftest
+from difftest import corpus, random_program, run, report
+
+
+#####
+# Tests
+###
+
+def test_engines_match_reference():
+    rng = random.Random(1234)
+    cases = corpus()
+    for index in range(20):
+        cases['random %d' % index] = random_program(rng)
+    results = run(cases, repeat=1)
+    print(report(results))
+    assert all(result.identical for result in results)
+
+def test_differences_are_reported():
+    def broken(path, **settings):
+        return 'not a rom'
+
+    def raises(path, **settings):
+        raise ValueError()
+
+    results = run({'case': 'a\nb'}, {'broken': broken, 'raises': raises},
+            repeat=1)
+    assert [result.identical for result in results] == [False, False]
+    assert results[0].detail.startswith('line 0:')
+    assert 'ValueError' in results[1].detail
+    assert 'NO' in report(results)
+
+def test_reference_is_frozen(monkeypatch):
+    # a change to compile.py has to show up as a difference
+    monkeypatch.setattr(difftest, 'compile', lambda assembly, **_: 'changed')
+    results = run({'case': 'a\nb'}, {'text': difftest.text_engine}, repeat=1)
+    assert not results[0].identical
@@ -0,0 +1,84 @@
+#!python3
+
+import os
+
+import pytest
+
+from compile import MultipleBanksException
+from simulate import simulate
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+#####
+# Tests
+###
+
+def test_all_instructions():
+    with open(os.path.join(HERE, 'all-inst-test.asm')) as fp:
+        assembly = fp.read()
+    simulator = simulate(assembly)
+    assert simulator.ip == 255
+    assert simulator.counts[255] == 1
+    assert simulator.never_executed() == [
+        1, 4, 8, 13, 16, 19, 22, 25, 28, 32, 36, 40, 44, 48, 52, 56, 60, 65]
+
+def test_profile():
+    simulator = simulate('''
+    main:
+        set(0, 3)
+        .loop:
+            acc(SAD, 0, -1)
+            {JMP, EQ, REG, 0, NUM, 0, @done}
+            jmp(@loop)
+    done:
+        mov(0, DOUT)
+    halt:
+        jmp(@halt)
+    ''', ip_inc=2, cycles={'JMP': 2})
+    assert simulator.outputs[-1][1:] == (30, 0)
+    assert list(simulator.counts[:10]) == [1, 0, 3, 0, 3, 0, 2, 0, 1, 0]
+    assert simulator.branches() == [(4, 1, 2)]
+    assert simulator.label_profile() == [('main.loop', 13), ('halt', 2),
+            ('main', 1), ('done', 1)]
+    assert simulator.hot_spots()[0] == (4, 3, 6, 'main.loop')
+    assert simulator.cycle == 17
+
+def test_inputs():
+    simulator = simulate('''
+    wait:
+        atc(SMPL, @read)
+        jmp(@wait)
+    read:
+        mov(DINP, DOUT)
+        jmp(@wait)
+    ''', inputs=[5, 7, 9], max_cycles=40)
+    assert [value for _, _, value in simulator.outputs] == [5, 7, 9]
+    assert simulator.never_executed() == []
+
+def test_listing():
+    assembly = '''
+    main:
+        jmp(@end) // skip
+        set(DOUT, 1)
+    end:
+        jmp(@end)'''
+    simulator = simulate(assembly)
+    assert simulator.listing(assembly).split('\n') == [
+        '          ',
+        '              main:',
+        '       1          jmp(@end) // skip',
+        '   #####          set(DOUT, 1)',
+        '              end:',
+        '       1          jmp(@end)',
+    ]
+
+def test_multiple_banks():
+    with pytest.raises(MultipleBanksException):
+        simulate('''
+        main:
+            jmp(@far_away)
+        .bank 1
+        far_away:
+            jmp(@far_away)
+        ''')